@@ -9,8 +9,24 @@ DATABASE_URL: str = os.environ.get(
 
 MAINTENANCE_TOKEN: str = os.environ.get("MAINTENANCE_TOKEN", "change-me-in-production")
 
+# Размер пула asyncpg: min прогревается на старте, max должен соответствовать
+# конкурентности сервера (мало — запросы встают в очередь, много — лишние
+# backend'ы Postgres)
+DB_POOL_MIN: int = int(os.environ.get("DB_POOL_MIN", "10"))
+DB_POOL_MAX: int = int(os.environ.get("DB_POOL_MAX", "50"))
+
+# Сколько запросов живёт соединение и сколько секунд простоя до закрытия
+DB_MAX_QUERIES: int = int(os.environ.get("DB_MAX_QUERIES", "50000"))
+DB_MAX_INACTIVE_LIFETIME: float = float(os.environ.get("DB_MAX_INACTIVE_LIFETIME", "300"))
+
 MAX_REPORTS_PER_HOUR: int = int(os.environ.get("MAX_REPORTS_PER_HOUR", "10"))
 
+# Разрешённые веб-origin'ы через запятую (основной клиент — десктопный,
+# CORS нужен только вспомогательным веб-страницам)
+CORS_ORIGINS: list[str] = [
+    o.strip() for o in os.environ.get("CORS_ORIGINS", "*").split(",") if o.strip()
+]
+
 # Минимальное количество голосов для промоута в verified
 MIN_VOTES_VERIFIED: int = 5
 
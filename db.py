@@ -1,15 +1,23 @@
 """Слой базы данных — asyncpg пул и все SQL-запросы."""
 
+import asyncio
 import hashlib
+import json
 import logging
 import ssl
+import time
 from pathlib import Path
-from typing import Optional
+from typing import NamedTuple, Optional
 
 import asyncpg
+from cachetools import TTLCache
 
 from config import (
     DATABASE_URL,
+    DB_POOL_MIN,
+    DB_POOL_MAX,
+    DB_MAX_QUERIES,
+    DB_MAX_INACTIVE_LIFETIME,
     MAX_REPORTS_PER_HOUR,
     MIN_VOTES_VERIFIED,
     VERIFIED_RATE_THRESHOLD,
@@ -30,9 +38,29 @@ def compute_strategy_hash(zapret_args: list[str]) -> str:
 
     Сортировка + lower + strip гарантирует, что порядок
     аргументов не влияет на хэш.
+
+    Алгоритм менять нельзя: хэш — ключ дедупликации в uq_strategy,
+    и уже записанные строки ссылаются на SHA-256 hex. Это не
+    криптография (usedforsecurity=False), а OpenSSL на x86 и так
+    использует SHA-NI.
     """
-    normalized = sorted(arg.strip().lower() for arg in zapret_args if arg.strip())
-    return hashlib.sha256("|".join(normalized).encode()).hexdigest()
+    normalized = [a for a in (arg.strip().lower() for arg in zapret_args) if a]
+    normalized.sort()
+    return hashlib.sha256("|".join(normalized).encode(), usedforsecurity=False).hexdigest()
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    """Per-connection init: кодек jsonb <-> list/dict.
+
+    Позволяет передавать zapret_args как питоновский список без
+    json.dumps + '::jsonb' на каждый запрос, а читать — сразу списком.
+    """
+    await conn.set_type_codec(
+        "jsonb",
+        encoder=lambda v: json.dumps(v, separators=(",", ":")),
+        decoder=json.loads,
+        schema="pg_catalog",
+    )
 
 
 async def init_pool() -> None:
@@ -47,14 +75,20 @@ async def init_pool() -> None:
     masked_url = DATABASE_URL[:25] + "***" if len(DATABASE_URL) > 25 else "???"
     logger.info("Connecting to DB: %s", masked_url)
 
+    # create_pool сразу открывает min_size соединений (TCP+TLS+auth),
+    # так что первые запросы после старта не платят за handshake
     _pool = await asyncpg.create_pool(
         DATABASE_URL,
-        min_size=2,
-        max_size=10,
+        min_size=DB_POOL_MIN,
+        max_size=DB_POOL_MAX,
+        # Долгоживущие соединения = дольше живёт кэш prepared statements
+        max_queries=DB_MAX_QUERIES,
+        max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+        init=_init_connection,
         ssl=ssl_ctx,
         command_timeout=30,
     )
-    logger.info("DB pool created")
+    logger.info("DB pool created (min=%d, max=%d)", DB_POOL_MIN, DB_POOL_MAX)
 
     # Авто-миграция: выполняем init.sql при каждом старте
     init_sql_path = Path(__file__).parent / "init.sql"
@@ -66,33 +100,64 @@ async def init_pool() -> None:
     else:
         logger.warning("init.sql not found at %s", init_sql_path)
 
+    # Коалесинг записей /report (см. upsert_strategy)
+    global _flusher_task
+    _flusher_task = asyncio.create_task(_flush_loop())
+
 
 async def close_pool() -> None:
-    """Закрывает пул."""
-    global _pool
+    """Останавливает флашер, дописывает хвост очереди и закрывает пул."""
+    global _pool, _flusher_task
+    if _flusher_task is not None:
+        _flusher_task.cancel()
+        _flusher_task = None
     if _pool is not None:
+        if _pending:
+            batch = _pending[:]
+            del _pending[:]
+            await _flush_batch(batch)
         await _pool.close()
         _pool = None
         logger.info("DB pool closed")
 
 
-def _compute_status(success_count: int, fail_count: int) -> str:
-    """Вычисляет статус стратегии по формуле из спеки."""
-    total = success_count + fail_count
-    if total < MIN_VOTES_VERIFIED:
-        return "unconfirmed"
-    rate = success_count / total
-    if rate >= VERIFIED_RATE_THRESHOLD:
-        return "verified"
-    if rate < STALE_RATE_THRESHOLD:
-        return "stale"
-    return "unconfirmed"
-
-
 # ---------------------------------------------------------------
 # GET /strategies
 # ---------------------------------------------------------------
 
+# Read-mostly выдачи кэшируем в памяти на короткий TTL: рейтинг стратегий
+# не требует посекундной свежести, а один горячий (provider, service)
+# опрашивается тысячами клиентов.
+_strat_cache: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+_services_cache: TTLCache = TTLCache(maxsize=1_000, ttl=30)
+
+# SQL хранится в константах: asyncpg кэширует prepared statements по тексту
+# запроса, так что одинаковая строка = готовый план без повторного парсинга.
+# success_rate — generated column (см. init.sql), не пересчитывается per-row
+_GET_STRATEGIES_SQL = """
+    SELECT id, zapret_args, success_count, fail_count,
+           avg_latency_ms, status, last_confirmed, success_rate
+    FROM strategies
+    WHERE provider_id = $1
+      AND service_id = $2
+      AND status IN ('verified', 'unconfirmed')
+    ORDER BY success_rate DESC, last_confirmed DESC
+    LIMIT $3
+"""
+
+_GET_STRATEGIES_FALLBACK_SQL = """
+    SELECT id, zapret_args, success_count, fail_count,
+           avg_latency_ms, status, last_confirmed, success_rate
+    FROM strategies
+    WHERE service_id = $1
+      AND provider_id != $2
+      AND status = 'verified'
+      AND success_rate >= $3
+    ORDER BY success_rate DESC, last_confirmed DESC
+    LIMIT $4
+"""
+
+
 async def get_strategies(
     provider_id: str,
     service_id: str,
@@ -100,20 +165,13 @@ async def get_strategies(
     """Топ стратегий по провайдеру × сервису с fallback на 'all'."""
     assert _pool is not None
 
+    cache_key = (provider_id, service_id)
+    cached = _strat_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     rows = await _pool.fetch(
-        """
-        SELECT id, zapret_args, success_count, fail_count,
-               avg_latency_ms, status, last_confirmed,
-               CASE WHEN (success_count + fail_count) > 0
-                    THEN success_count::float / (success_count + fail_count)
-                    ELSE 0 END AS success_rate
-        FROM strategies
-        WHERE provider_id = $1
-          AND service_id = $2
-          AND status IN ('verified', 'unconfirmed')
-        ORDER BY success_rate DESC, last_confirmed DESC
-        LIMIT $3
-        """,
+        _GET_STRATEGIES_SQL,
         provider_id,
         service_id,
         MAX_STRATEGIES_RESPONSE,
@@ -125,22 +183,7 @@ async def get_strategies(
     if len(results) < MIN_PROVIDER_STRATEGIES:
         existing_hashes = {r["id"] for r in results}
         fallback_rows = await _pool.fetch(
-            """
-            SELECT id, zapret_args, success_count, fail_count,
-                   avg_latency_ms, status, last_confirmed,
-                   CASE WHEN (success_count + fail_count) > 0
-                        THEN success_count::float / (success_count + fail_count)
-                        ELSE 0 END AS success_rate
-            FROM strategies
-            WHERE service_id = $1
-              AND provider_id != $2
-              AND status = 'verified'
-              AND CASE WHEN (success_count + fail_count) > 0
-                       THEN success_count::float / (success_count + fail_count)
-                       ELSE 0 END >= $3
-            ORDER BY success_rate DESC, last_confirmed DESC
-            LIMIT $4
-            """,
+            _GET_STRATEGIES_FALLBACK_SQL,
             service_id,
             provider_id,
             FALLBACK_SUCCESS_RATE,
@@ -150,29 +193,154 @@ async def get_strategies(
             if r["id"] not in existing_hashes:
                 results.append(dict(r))
 
-    return results[:MAX_STRATEGIES_RESPONSE]
+    results = results[:MAX_STRATEGIES_RESPONSE]
+    _strat_cache[cache_key] = results
+    return results
 
 
 # ---------------------------------------------------------------
 # POST /report
 # ---------------------------------------------------------------
 
+# Скользящее окно со счётчиками на fingerprint:
+# (id текущего окна, счётчик текущего окна, счётчик предыдущего окна).
+# Держим в памяти процесса — без похода в БД на каждый /report.
+_rate_buckets: dict[str, tuple[int, int, int]] = {}
+
+# Ширина окна rate limit — час
+_RATE_WINDOW_SEC: int = 3600
+
+
 async def check_rate_limit(fingerprint: str) -> bool:
     """Проверяет rate limit: <= MAX_REPORTS_PER_HOUR за последний час.
 
+    Sliding-window counter в памяти процесса: два счётчика на fingerprint
+    (текущее и предыдущее окно) + взвешенная интерполяция. O(1) памяти
+    на пользователя, без SQL-запроса.
+
     Returns:
         True если лимит НЕ превышен.
     """
-    assert _pool is not None
-    count = await _pool.fetchval(
-        """
-        SELECT COUNT(*) FROM reports
-        WHERE fingerprint = $1
-          AND reported_at > NOW() - INTERVAL '1 hour'
-        """,
-        fingerprint,
-    )
-    return count < MAX_REPORTS_PER_HOUR
+    now = time.time()
+    window_id = int(now // _RATE_WINDOW_SEC)
+    elapsed_frac = (now % _RATE_WINDOW_SEC) / _RATE_WINDOW_SEC
+
+    cur_window, cur_count, prev_count = _rate_buckets.get(fingerprint, (window_id, 0, 0))
+    if window_id != cur_window:
+        # Сдвиг окна: текущее становится предыдущим (или обнуляется, если
+        # с последнего отчёта прошло больше одного окна)
+        prev_count = cur_count if window_id == cur_window + 1 else 0
+        cur_count = 0
+
+    approx_count = prev_count * (1.0 - elapsed_frac) + cur_count
+    if approx_count >= MAX_REPORTS_PER_HOUR:
+        _rate_buckets[fingerprint] = (window_id, cur_count, prev_count)
+        return False
+
+    _rate_buckets[fingerprint] = (window_id, cur_count + 1, prev_count)
+    return True
+
+
+def sweep_rate_buckets() -> int:
+    """Выкидывает из памяти счётчики, не активные дольше одного окна.
+
+    Returns:
+        Количество удалённых записей.
+    """
+    current_window = int(time.time() // _RATE_WINDOW_SEC)
+    stale_keys = [
+        fp for fp, (window, _, _) in _rate_buckets.items()
+        if window < current_window - 1
+    ]
+    for fp in stale_keys:
+        del _rate_buckets[fp]
+    return len(stale_keys)
+
+
+def _status_case_sql(
+    success_expr: str,
+    fail_expr: str,
+    min_votes: str,
+    verified: str,
+    stale: str,
+) -> str:
+    """CASE-выражение статуса по счётчикам ПОСЛЕ инкремента.
+
+    Дублирует формулу из спеки на стороне SQL, чтобы статус писался
+    в той же версии строки, что и счётчики. min_votes/verified/stale —
+    плейсхолдеры параметров ($N) для порогов.
+    """
+    total = f"({success_expr} + {fail_expr})"
+    rate = f"({success_expr}::float / {total})"
+    return f"""
+        CASE WHEN {total} < {min_votes} THEN 'unconfirmed'
+             WHEN {rate} >= {verified} THEN 'verified'
+             WHEN {rate} < {stale} THEN 'stale'
+             ELSE 'unconfirmed'
+        END
+    """
+
+
+# Батчевый UPSERT: один запрос на все сгруппированные (provider, service,
+# hash) из окна коалесинга. EXCLUDED.success_count/fail_count — дельты
+# батча, avg_latency_ms в EXCLUDED — среднее по батчу.
+_BATCH_UPSERT_SQL = f"""
+    INSERT INTO strategies AS s
+        (provider_id, service_id, zapret_args, strategy_hash,
+         success_count, fail_count, avg_latency_ms,
+         last_confirmed, first_reported, status)
+    SELECT v.provider_id, v.service_id, v.zapret_args, v.strategy_hash,
+           v.n_succ, v.n_fail,
+           CASE WHEN v.n_succ > 0 THEN v.sum_lat / v.n_succ ELSE 0 END,
+           NOW(), NOW(),
+           {_status_case_sql("v.n_succ", "v.n_fail", "$8", "$9", "$10")}
+    FROM unnest($1::text[], $2::text[], $3::jsonb[], $4::text[],
+                $5::int[], $6::int[], $7::float8[])
+         AS v(provider_id, service_id, zapret_args, strategy_hash,
+              n_succ, n_fail, sum_lat)
+    ON CONFLICT (provider_id, service_id, strategy_hash)
+    DO UPDATE SET
+        success_count = s.success_count + EXCLUDED.success_count,
+        fail_count = s.fail_count + EXCLUDED.fail_count,
+        -- Слияние средних в форме Уэлфорда (m_a + n_b*(m_b-m_a)/(n_a+n_b)):
+        -- без умножения среднего на большой счётчик — не дрейфует на
+        -- миллионах обновлений
+        avg_latency_ms = CASE
+            WHEN s.success_count + EXCLUDED.success_count > 0
+            THEN s.avg_latency_ms
+                 + EXCLUDED.success_count
+                   * (EXCLUDED.avg_latency_ms - s.avg_latency_ms)
+                   / (s.success_count + EXCLUDED.success_count)
+            ELSE 0 END,
+        last_confirmed = CASE WHEN EXCLUDED.success_count > 0
+                              THEN NOW() ELSE s.last_confirmed END,
+        status = {_status_case_sql(
+            "(s.success_count + EXCLUDED.success_count)",
+            "(s.fail_count + EXCLUDED.fail_count)",
+            "$8", "$9", "$10")}
+    RETURNING id, provider_id, service_id, strategy_hash, status
+"""
+
+# Окно коалесинга записей: отчёты, пришедшие в пределах окна,
+# коммитятся одной транзакцией
+_FLUSH_INTERVAL_SEC: float = 0.02
+
+
+class _PendingReport(NamedTuple):
+    provider_id: str
+    service_id: str
+    zapret_args: list[str]
+    strategy_hash: str
+    success: bool
+    latency_ms: float
+    fingerprint: str
+    client_version: str
+    future: "asyncio.Future[tuple[int, str]]"
+
+
+_pending: list[_PendingReport] = []
+_flush_event = asyncio.Event()
+_flusher_task: Optional[asyncio.Task] = None
 
 
 async def upsert_strategy(
@@ -184,174 +352,231 @@ async def upsert_strategy(
     fingerprint: str,
     client_version: str,
 ) -> tuple[int, str]:
-    """UPSERT стратегии + вставка отчёта.
+    """Ставит отчёт в очередь коалесинга и ждёт результат флаша.
+
+    Конкурентные отчёты в пределах _FLUSH_INTERVAL_SEC объединяются
+    в один батчевый UPSERT — одна транзакция и один WAL fsync на батч
+    вместо транзакции на отчёт.
 
     Returns:
         (strategy_id, strategy_status)
     """
     assert _pool is not None
 
-    strategy_hash = compute_strategy_hash(zapret_args)
-    import json
-    args_json = json.dumps(zapret_args)
-
-    async with _pool.acquire() as conn:
-        async with conn.transaction():
-            # UPSERT стратегии
-            if success:
-                row = await conn.fetchrow(
-                    """
-                    INSERT INTO strategies
-                        (provider_id, service_id, zapret_args, strategy_hash,
-                         success_count, fail_count, avg_latency_ms,
-                         last_confirmed, first_reported, status)
-                    VALUES ($1, $2, $3::jsonb, $4, 1, 0, $5, NOW(), NOW(), 'unconfirmed')
-                    ON CONFLICT (provider_id, service_id, strategy_hash)
-                    DO UPDATE SET
-                        success_count = strategies.success_count + 1,
-                        avg_latency_ms = (strategies.avg_latency_ms * strategies.success_count + $5)
-                                         / (strategies.success_count + 1),
-                        last_confirmed = NOW()
-                    RETURNING id, success_count, fail_count
-                    """,
-                    provider_id,
-                    service_id,
-                    args_json,
-                    strategy_hash,
-                    latency_ms,
+    future: asyncio.Future[tuple[int, str]] = asyncio.get_running_loop().create_future()
+    _pending.append(_PendingReport(
+        provider_id,
+        service_id,
+        zapret_args,
+        compute_strategy_hash(zapret_args),
+        success,
+        latency_ms,
+        fingerprint,
+        client_version,
+        future,
+    ))
+    _flush_event.set()
+    return await future
+
+
+async def _flush_loop() -> None:
+    """Фоновый цикл: ждёт первый отчёт, выдерживает окно, флашит батч."""
+    while True:
+        await _flush_event.wait()
+        await asyncio.sleep(_FLUSH_INTERVAL_SEC)
+        _flush_event.clear()
+        batch = _pending[:]
+        del _pending[:]
+        if batch:
+            await _flush_batch(batch)
+
+
+async def _flush_batch(batch: list[_PendingReport]) -> None:
+    """Пишет батч отчётов: один UPSERT по группам + одна вставка reports."""
+    assert _pool is not None
+
+    # Группировка по стратегии: дельты счётчиков и сумма латентности
+    groups: dict[tuple[str, str, str], list[_PendingReport]] = {}
+    for p in batch:
+        groups.setdefault((p.provider_id, p.service_id, p.strategy_hash), []).append(p)
+
+    providers, services, args_list, hashes = [], [], [], []
+    n_succ_arr, n_fail_arr, sum_lat_arr = [], [], []
+    for (prov, svc, shash), items in groups.items():
+        providers.append(prov)
+        services.append(svc)
+        args_list.append(items[0].zapret_args)
+        hashes.append(shash)
+        n_succ_arr.append(sum(1 for p in items if p.success))
+        n_fail_arr.append(sum(1 for p in items if not p.success))
+        sum_lat_arr.append(sum(p.latency_ms for p in items if p.success))
+
+    try:
+        async with _pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(
+                    _BATCH_UPSERT_SQL,
+                    providers,
+                    services,
+                    args_list,
+                    hashes,
+                    n_succ_arr,
+                    n_fail_arr,
+                    sum_lat_arr,
+                    MIN_VOTES_VERIFIED,
+                    VERIFIED_RATE_THRESHOLD,
+                    STALE_RATE_THRESHOLD,
                 )
-            else:
-                row = await conn.fetchrow(
-                    """
-                    INSERT INTO strategies
-                        (provider_id, service_id, zapret_args, strategy_hash,
-                         success_count, fail_count, avg_latency_ms,
-                         first_reported, status)
-                    VALUES ($1, $2, $3::jsonb, $4, 0, 1, 0, NOW(), 'unconfirmed')
-                    ON CONFLICT (provider_id, service_id, strategy_hash)
-                    DO UPDATE SET
-                        fail_count = strategies.fail_count + 1
-                    RETURNING id, success_count, fail_count
-                    """,
-                    provider_id,
-                    service_id,
-                    args_json,
-                    strategy_hash,
+                by_key = {
+                    (r["provider_id"], r["service_id"], r["strategy_hash"]):
+                        (r["id"], r["status"])
+                    for r in rows
+                }
+                # Бинарный COPY вместо INSERT: без SQL-парсинга и
+                # пер-строчного биндинга параметров
+                await conn.copy_records_to_table(
+                    "reports",
+                    records=[
+                        (
+                            by_key[(p.provider_id, p.service_id, p.strategy_hash)][0],
+                            p.fingerprint,
+                            p.success,
+                            p.latency_ms,
+                            p.client_version,
+                        )
+                        for p in batch
+                    ],
+                    columns=("strategy_id", "fingerprint", "success",
+                             "latency_ms", "client_version"),
                 )
+    except Exception as exc:
+        logger.error("Report batch flush failed (%d reports): %s", len(batch), exc)
+        for p in batch:
+            if not p.future.done():
+                p.future.set_exception(exc)
+        return
+
+    for key, items in groups.items():
+        strategy_id, status = by_key[key]
+        for p in items:
+            if not p.future.done():
+                p.future.set_result((strategy_id, status))
 
-            strategy_id = row["id"]
-            new_status = _compute_status(row["success_count"], row["fail_count"])
-
-            # Обновляем статус
-            await conn.execute(
-                "UPDATE strategies SET status = $1 WHERE id = $2",
-                new_status,
-                strategy_id,
-            )
-
-            # Вставляем отчёт
-            await conn.execute(
-                """
-                INSERT INTO reports
-                    (strategy_id, fingerprint, success, latency_ms, client_version)
-                VALUES ($1, $2, $3, $4, $5)
-                """,
-                strategy_id,
-                fingerprint,
-                success,
-                latency_ms,
-                client_version,
-            )
-
-    return strategy_id, new_status
+    # Свежие отчёты делают кэшированные выдачи по этим ключам устаревшими
+    for prov, svc, _ in groups:
+        _strat_cache.pop((prov, svc), None)
+        _services_cache.pop(prov, None)
 
 
 # ---------------------------------------------------------------
 # GET /services
 # ---------------------------------------------------------------
 
+# Счётчики активных стратегий материализованы в service_strategy_counts
+# (триггер в init.sql): каталог = join по PK вместо COUNT(*) по strategies
+_GET_SERVICES_SQL = """
+    SELECT sc.id, sc.display_name, sc.category, sc.main_domain,
+           sc.icon_emoji,
+           COALESCE(c.active_count, 0) AS strategy_count
+    FROM services_catalog sc
+    LEFT JOIN service_strategy_counts c
+           ON c.provider_id = $1 AND c.service_id = sc.id
+    ORDER BY strategy_count DESC, sc.display_name
+"""
+
+
 async def get_services(provider_id: str) -> list[dict]:
     """Каталог сервисов с количеством стратегий для провайдера."""
     assert _pool is not None
 
-    rows = await _pool.fetch(
-        """
-        SELECT sc.id, sc.display_name, sc.category, sc.main_domain,
-               sc.icon_emoji,
-               COALESCE(cnt.strategy_count, 0) AS strategy_count
-        FROM services_catalog sc
-        LEFT JOIN (
-            SELECT service_id, COUNT(*) AS strategy_count
-            FROM strategies
-            WHERE provider_id = $1
-              AND status IN ('verified', 'unconfirmed')
-            GROUP BY service_id
-        ) cnt ON cnt.service_id = sc.id
-        ORDER BY strategy_count DESC, sc.display_name
-        """,
-        provider_id,
-    )
-    return [dict(r) for r in rows]
+    cached = _services_cache.get(provider_id)
+    if cached is not None:
+        return cached
+
+    rows = await _pool.fetch(_GET_SERVICES_SQL, provider_id)
+    results = [dict(r) for r in rows]
+    _services_cache[provider_id] = results
+    return results
 
 
 # ---------------------------------------------------------------
 # GET /health
 # ---------------------------------------------------------------
 
+_HEALTH_STATS_SQL = """
+    SELECT
+        COUNT(*) AS total,
+        COUNT(*) FILTER (WHERE status = 'verified') AS verified,
+        COUNT(*) FILTER (WHERE status = 'unconfirmed') AS unconfirmed,
+        COUNT(*) FILTER (WHERE status = 'degraded') AS degraded,
+        COUNT(*) FILTER (WHERE status = 'stale') AS stale
+    FROM strategies
+"""
+
+# /health дёргают liveness-пробы балансировщика — COUNT(*) по всей
+# таблице чаще раза в 10 секунд не нужен
+_health_cache: TTLCache = TTLCache(maxsize=1, ttl=10)
+
+
 async def get_health_stats() -> dict:
-    """Статистика по стратегиям."""
+    """Статистика по стратегиям (кэш 10 секунд)."""
     assert _pool is not None
 
-    row = await _pool.fetchrow(
-        """
-        SELECT
-            COUNT(*) AS total,
-            COUNT(*) FILTER (WHERE status = 'verified') AS verified,
-            COUNT(*) FILTER (WHERE status = 'unconfirmed') AS unconfirmed,
-            COUNT(*) FILTER (WHERE status = 'degraded') AS degraded,
-            COUNT(*) FILTER (WHERE status = 'stale') AS stale
-        FROM strategies
-        """
-    )
-    return dict(row)
+    cached = _health_cache.get("stats")
+    if cached is not None:
+        return cached
+
+    row = await _pool.fetchrow(_HEALTH_STATS_SQL)
+    stats = dict(row)
+    _health_cache["stats"] = stats
+    return stats
 
 
 # ---------------------------------------------------------------
 # POST /maintenance/cleanup
 # ---------------------------------------------------------------
 
+# Оба UPDATE в одном CTE-запросе — один проход и один round-trip.
+# Условие degraded исключает кандидатов в stale: CTE не могут менять
+# одну и ту же строку дважды в одном запросе.
+_CLEANUP_SQL = """
+    WITH s AS (
+        UPDATE strategies
+        SET status = 'stale'
+        WHERE last_confirmed < NOW() - make_interval(days => $1)
+          AND status <> 'stale'
+        RETURNING 1
+    ),
+    d AS (
+        UPDATE strategies
+        SET status = 'degraded'
+        WHERE last_confirmed >= NOW() - make_interval(days => $1)
+          AND (success_count + fail_count) >= $2
+          AND success_rate < $3
+          AND status NOT IN ('stale', 'degraded')
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM s) AS stale_marked,
+           (SELECT COUNT(*) FROM d) AS degraded_marked
+"""
+
+
 async def run_cleanup() -> tuple[int, int]:
-    """Cron-задача: mark-stale + mark-degraded.
+    """Cron-задача: mark-stale + mark-degraded одним запросом.
 
     Returns:
         (stale_marked, degraded_marked)
     """
     assert _pool is not None
 
-    # Mark stale: 7 дней без подтверждений
-    stale_result = await _pool.execute(
-        """
-        UPDATE strategies
-        SET status = 'stale'
-        WHERE last_confirmed < NOW() - INTERVAL '%s days'
-          AND status NOT IN ('stale')
-        """ % STALE_DAYS
-    )
-    stale_count = int(stale_result.split()[-1]) if stale_result else 0
-
-    # Mark degraded: success_rate < 40% среди стратегий с 5+ голосами
-    degraded_result = await _pool.execute(
-        """
-        UPDATE strategies
-        SET status = 'degraded'
-        WHERE (success_count + fail_count) >= $1
-          AND success_count::float / (success_count + fail_count) < $2
-          AND status NOT IN ('stale', 'degraded')
-        """,
+    row = await _pool.fetchrow(
+        _CLEANUP_SQL,
+        STALE_DAYS,
         MIN_VOTES_VERIFIED,
         STALE_RATE_THRESHOLD,
     )
-    degraded_count = int(degraded_result.split()[-1]) if degraded_result else 0
+    stale_count = row["stale_marked"]
+    degraded_count = row["degraded_marked"]
 
     logger.info("Cleanup: stale=%d, degraded=%d", stale_count, degraded_count)
     return stale_count, degraded_count
@@ -23,6 +23,36 @@ CREATE INDEX IF NOT EXISTS idx_strategies_lookup
 CREATE INDEX IF NOT EXISTS idx_strategies_last_confirmed
     ON strategies (last_confirmed);
 
+-- Частичные покрывающие индексы под GET /strategies: выдача читается
+-- прямо из индекса (index-only scan) без сортировки всей таблицы
+CREATE INDEX IF NOT EXISTS idx_strat_ps_active
+    ON strategies (provider_id, service_id, last_confirmed DESC)
+    INCLUDE (success_count, fail_count, avg_latency_ms, zapret_args, status)
+    WHERE status IN ('verified', 'unconfirmed');
+CREATE INDEX IF NOT EXISTS idx_strat_s_verified
+    ON strategies (service_id, last_confirmed DESC)
+    INCLUDE (provider_id, success_count, fail_count, avg_latency_ms, zapret_args)
+    WHERE status = 'verified';
+
+-- success_rate считается при записи (generated column), а не в каждом
+-- SELECT/ORDER BY; индекс позволяет отдавать топ-5 index-ordered сканом
+ALTER TABLE strategies
+    ADD COLUMN IF NOT EXISTS success_rate DOUBLE PRECISION
+    GENERATED ALWAYS AS (
+        CASE WHEN success_count + fail_count > 0
+             THEN success_count::float / (success_count + fail_count)
+             ELSE 0 END
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_strat_rate
+    ON strategies (provider_id, service_id, success_rate DESC, last_confirmed DESC)
+    WHERE status IN ('verified', 'unconfirmed');
+
+-- Скан cleanup-джобы ограничен ещё не протухшими строками
+CREATE INDEX IF NOT EXISTS idx_strat_cleanup
+    ON strategies (last_confirmed)
+    WHERE status <> 'stale';
+
 -- Таблица отчётов (для rate limiting и аналитики)
 CREATE TABLE IF NOT EXISTS reports (
     id              BIGSERIAL PRIMARY KEY,
@@ -39,6 +69,64 @@ CREATE INDEX IF NOT EXISTS idx_reports_fingerprint_time
 CREATE INDEX IF NOT EXISTS idx_reports_strategy
     ON reports (strategy_id);
 
+-- Материализованный счётчик активных стратегий на (провайдер, сервис):
+-- GET /services читает его вместо агрегации по strategies
+CREATE TABLE IF NOT EXISTS service_strategy_counts (
+    provider_id     VARCHAR(50)  NOT NULL,
+    service_id      VARCHAR(100) NOT NULL,
+    active_count    INTEGER      NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (provider_id, service_id)
+);
+
+-- Триггер держит счётчики в актуальном состоянии на любом пути записи
+-- (UPSERT отчётов, cleanup-переходы статусов)
+CREATE OR REPLACE FUNCTION strategies_maintain_counts() RETURNS trigger AS $fn$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.status IN ('verified', 'unconfirmed') THEN
+            INSERT INTO service_strategy_counts (provider_id, service_id, active_count)
+            VALUES (NEW.provider_id, NEW.service_id, 1)
+            ON CONFLICT (provider_id, service_id)
+            DO UPDATE SET active_count = service_strategy_counts.active_count + 1;
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        IF OLD.status IN ('verified', 'unconfirmed') THEN
+            UPDATE service_strategy_counts
+            SET active_count = active_count - 1
+            WHERE provider_id = OLD.provider_id AND service_id = OLD.service_id;
+        END IF;
+    ELSE  -- UPDATE
+        IF NEW.status IN ('verified', 'unconfirmed')
+           AND OLD.status NOT IN ('verified', 'unconfirmed') THEN
+            INSERT INTO service_strategy_counts (provider_id, service_id, active_count)
+            VALUES (NEW.provider_id, NEW.service_id, 1)
+            ON CONFLICT (provider_id, service_id)
+            DO UPDATE SET active_count = service_strategy_counts.active_count + 1;
+        ELSIF OLD.status IN ('verified', 'unconfirmed')
+              AND NEW.status NOT IN ('verified', 'unconfirmed') THEN
+            UPDATE service_strategy_counts
+            SET active_count = active_count - 1
+            WHERE provider_id = OLD.provider_id AND service_id = OLD.service_id;
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$fn$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_strategies_counts ON strategies;
+CREATE TRIGGER trg_strategies_counts
+    AFTER INSERT OR UPDATE OF status OR DELETE ON strategies
+    FOR EACH ROW EXECUTE FUNCTION strategies_maintain_counts();
+
+-- Бэкфилл пар, которых ещё нет в счётчиках (идемпотентно)
+INSERT INTO service_strategy_counts (provider_id, service_id, active_count)
+SELECT provider_id, service_id, COUNT(*)
+FROM strategies
+WHERE status IN ('verified', 'unconfirmed')
+GROUP BY provider_id, service_id
+ON CONFLICT (provider_id, service_id) DO NOTHING;
+
 -- Каталог сервисов
 CREATE TABLE IF NOT EXISTS services_catalog (
     id              VARCHAR(100) PRIMARY KEY,
@@ -5,18 +5,14 @@ import logging
 
 from fastapi import FastAPI, HTTPException, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 import db
-from config import MAINTENANCE_TOKEN
+from config import CORS_ORIGINS, MAINTENANCE_TOKEN
 from models import (
     CleanupResponse,
-    HealthResponse,
     ReportRequest,
     ReportResponse,
-    ServicesResponse,
-    ServiceItem,
-    StrategiesResponse,
-    StrategyItem,
 )
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
@@ -26,13 +22,19 @@ app = FastAPI(
     title="PODSOS Crowdsource Server",
     version="0.1.0",
     description="Краудсорсинг стратегий обхода DPI для PODSOS ОЧКА",
+    # orjson сериализует ответы в разы быстрее stdlib json
+    # и умеет datetime нативно
+    default_response_class=ORJSONResponse,
 )
 
+# Конечные списки методов/заголовков + max_age: preflight-ответ статичен
+# и кэшируется браузером сутки вместо OPTIONS на каждый запрос
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "x-maintenance-token"],
+    max_age=86400,
 )
 
 
@@ -50,7 +52,11 @@ async def _periodic_cleanup() -> None:
         await asyncio.sleep(_CLEANUP_INTERVAL_SEC)
         try:
             stale, degraded = await db.run_cleanup()
-            logger.info("Auto-cleanup done: stale=%d, degraded=%d", stale, degraded)
+            evicted = db.sweep_rate_buckets()
+            logger.info(
+                "Auto-cleanup done: stale=%d, degraded=%d, rate buckets evicted=%d",
+                stale, degraded, evicted,
+            )
         except Exception as exc:
             logger.error("Auto-cleanup failed: %s", exc)
 
@@ -76,7 +82,10 @@ async def shutdown():
 # GET /strategies
 # -------------------------------------------------------------------
 
-@app.get("/strategies", response_model=StrategiesResponse)
+# Read-эндпоинты отдают словари напрямую: данные приходят из нашей же БД,
+# прогонять их через Pydantic-валидацию ответа дважды — чистый CPU-налог.
+# Схемы ответов задокументированы в models.py.
+@app.get("/strategies")
 async def get_strategies(
     provider: str = Query(..., min_length=1, description="ID провайдера"),
     service: str = Query(..., min_length=1, description="ID сервиса"),
@@ -84,22 +93,22 @@ async def get_strategies(
     """Топ стратегий обхода для провайдера × сервиса."""
     rows = await db.get_strategies(provider, service)
 
-    strategies = []
-    for r in rows:
-        total = r["success_count"] + r["fail_count"]
-        rate = r["success_count"] / total if total > 0 else 0.0
-        strategies.append(StrategyItem(
-            id=r["id"],
-            zapret_args=r["zapret_args"],
-            success_count=r["success_count"],
-            fail_count=r["fail_count"],
-            success_rate=round(rate, 4),
-            avg_latency_ms=round(r["avg_latency_ms"], 1),
-            status=r["status"],
-            last_confirmed=r["last_confirmed"],
-        ))
-
-    return StrategiesResponse(strategies=strategies, count=len(strategies))
+    return {
+        "strategies": [
+            {
+                "id": r["id"],
+                "zapret_args": r["zapret_args"],
+                "success_count": r["success_count"],
+                "fail_count": r["fail_count"],
+                "success_rate": round(r["success_rate"], 4),
+                "avg_latency_ms": round(r["avg_latency_ms"], 1),
+                "status": r["status"],
+                "last_confirmed": r["last_confirmed"],
+            }
+            for r in rows
+        ],
+        "count": len(rows),
+    }
 
 
 # -------------------------------------------------------------------
@@ -140,57 +149,57 @@ async def post_report(body: ReportRequest):
 # GET /services
 # -------------------------------------------------------------------
 
-@app.get("/services", response_model=ServicesResponse)
+@app.get("/services")
 async def get_services(
     provider: str = Query(..., min_length=1, description="ID провайдера"),
 ):
     """Каталог сервисов с количеством стратегий для провайдера."""
     rows = await db.get_services(provider)
 
-    services = [
-        ServiceItem(
-            id=r["id"],
-            display_name=r["display_name"],
-            category=r["category"],
-            main_domain=r["main_domain"],
-            icon_emoji=r.get("icon_emoji", ""),
-            strategy_count=r["strategy_count"],
-        )
-        for r in rows
-    ]
-
-    return ServicesResponse(services=services)
+    return {
+        "services": [
+            {
+                "id": r["id"],
+                "display_name": r["display_name"],
+                "category": r["category"],
+                "main_domain": r["main_domain"],
+                "icon_emoji": r.get("icon_emoji", ""),
+                "strategy_count": r["strategy_count"],
+            }
+            for r in rows
+        ]
+    }
 
 
 # -------------------------------------------------------------------
 # GET /health
 # -------------------------------------------------------------------
 
-@app.get("/health", response_model=HealthResponse)
+@app.get("/health")
 async def health():
     """Статус сервера."""
     try:
         stats = await db.get_health_stats()
-        return HealthResponse(
-            status="ok",
-            strategies_count=stats["total"],
-            verified_count=stats["verified"],
-            unconfirmed_count=stats["unconfirmed"],
-            degraded_count=stats["degraded"],
-            stale_count=stats["stale"],
-            db_connected=True,
-        )
+        return {
+            "status": "ok",
+            "strategies_count": stats["total"],
+            "verified_count": stats["verified"],
+            "unconfirmed_count": stats["unconfirmed"],
+            "degraded_count": stats["degraded"],
+            "stale_count": stats["stale"],
+            "db_connected": True,
+        }
     except Exception as exc:
         logger.error("Health check failed: %s", exc)
-        return HealthResponse(
-            status="error",
-            strategies_count=0,
-            verified_count=0,
-            unconfirmed_count=0,
-            degraded_count=0,
-            stale_count=0,
-            db_connected=False,
-        )
+        return {
+            "status": "error",
+            "strategies_count": 0,
+            "verified_count": 0,
+            "unconfirmed_count": 0,
+            "degraded_count": 0,
+            "stale_count": 0,
+            "db_connected": False,
+        }
 
 
 # -------------------------------------------------------------------